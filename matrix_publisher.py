@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 import os
-import json
+import sys
+import math
+import queue
+import atexit
+import logging
 import time
 import random
+import sched
+import socket
 import threading
+import orjson
+import numpy as np
 import paho.mqtt.client as mqtt
 from datetime import datetime, timedelta
-from collections import deque, Counter
+from logging.handlers import QueueHandler, QueueListener
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba has no musl wheels, fall back to plain Python on the alpine image
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 # # MQTT Configuration
 # MQTT_HOST = 'localhost'
@@ -16,25 +32,147 @@ from collections import deque, Counter
 MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
 MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
 MQTT_CLIENT_ID = f'simplified-ai-{random.randint(1000, 9999)}'
+# Set to share vehicle/actions across replicas through a $share/<group>/ subscription
+MQTT_SHARED_GROUP = os.getenv('MQTT_SHARED_GROUP', '')
+ACTIONS_TOPIC = 'vehicle/actions'
 # AI Configuration
 LEARNING_PERIOD = 30  # 30 seconds learning period
 RECOMMENDATION_INTERVAL = 20  # Send recommendation every 20 seconds
 BREAK_REMINDER_TIME = 200  # Break reminder after 200 seconds
 MAX_RECOMMENDATIONS_PER_SESSION = 50
+HISTORY_SIZE = 50  # Most recent actions kept for learning
+# Publishing
+RECOMMENDATIONS_TOPIC = 'vehicle/recommendations'
+RECOMMENDATIONS_QOS = 0  # Fire-and-forget, never wait on a broker round trip
+MAX_INFLIGHT_MESSAGES = 1000
+PAYLOAD_CACHE_SIZE = 128  # Encoded recommendation lists kept for reuse
+# Constant parts of the {"type", "recommendations", "timestamp"} payload, encoded once
+ENVELOPE_PREFIX = b'{"type":"ai_suggestion","recommendations":'
+ENVELOPE_MIDDLE = b',"timestamp":"'
+ENVELOPE_SUFFIX = b'"}'
+
+# Logging: callers (including the MQTT network threads) only enqueue records,
+# a listener thread does the formatting and the blocking stdout writes
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueue records unformatted, QueueHandler.prepare would format them on the calling thread"""
+    def prepare(self, record):
+        return record
+
+log = logging.getLogger('simplified-ai')
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_queue = queue.SimpleQueue()
+log.addHandler(_DeferredQueueHandler(_log_queue))
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+def _encode_payload(recommendations):
+    """Encode a recommendation payload, only the recommendations and timestamp go through orjson"""
+    return _wrap_payload(orjson.dumps(recommendations))
+
+def _wrap_payload(encoded_recommendations):
+    """Wrap already encoded recommendations in the payload envelope with a fresh timestamp"""
+    return (ENVELOPE_PREFIX + encoded_recommendations + ENVELOPE_MIDDLE +
+            datetime.now().isoformat().encode() + ENVELOPE_SUFFIX)
+
+# nogil: the kernel only touches the int arrays and returns plain ints/bools,
+# so it releases the GIL and the rx network thread keeps reading while it runs
+@njit(nogil=True, cache=True)
+def _reduce_prefs(h_act, h_val, temp_id, vol_id, seat_id, play_id, heat_id):
+    """One pass over the history buffer: average temperature/volume/seat (-1 if unseen), music and seat heat flags"""
+    temp_sum = temp_n = vol_sum = vol_n = seat_sum = seat_n = 0
+    likes_music = likes_warm = False
+    for i in range(h_act.shape[0]):
+        a = h_act[i]
+        v = h_val[i]
+        if a == temp_id and v != 0:
+            temp_sum += v
+            temp_n += 1
+        elif a == vol_id and v != 0:
+            vol_sum += v
+            vol_n += 1
+        elif a == seat_id and v != 0:
+            seat_sum += v
+            seat_n += 1
+        elif a == play_id:
+            likes_music = True
+        elif a == heat_id:
+            likes_warm = True
+    return (temp_sum // temp_n if temp_n else -1,
+            vol_sum // vol_n if vol_n else -1,
+            seat_sum // seat_n if seat_n else -1,
+            likes_music, likes_warm)
+
+def _reduce_prefs_numpy(h_act, h_val, temp_id, vol_id, seat_id, play_id, heat_id):
+    """Same result as _reduce_prefs from three bincounts over the buffer, no per-element Python loop"""
+    bins = h_act.astype(np.intp) + 1  # Shift so empty/unknown slots (-1) land in bin 0
+    size = max(temp_id, vol_id, seat_id, play_id, heat_id) + 2
+    counts = np.bincount(bins, weights=h_val != 0, minlength=size).tolist()
+    sums = np.bincount(bins, weights=h_val, minlength=size).tolist()
+    seen = np.bincount(bins, minlength=size).tolist()
+    
+    def average(action_id):
+        n = int(counts[action_id + 1])
+        return sums[action_id + 1] // n if n else -1
+    
+    return (average(temp_id), average(vol_id), average(seat_id),
+            seen[play_id + 1] > 0, seen[heat_id + 1] > 0)
+
+if not NUMBA_AVAILABLE:
+    # Interpreted, the kernel loops over NumPy scalars and is slower than the vectorised version
+    _reduce_prefs = _reduce_prefs_numpy
 
 class SimplifiedVehicleAI:
+    # Car state update per action, looked up once instead of walking an if/elif chain
+    _ACTION_HANDLERS = {
+        'climate_turn_on': lambda s, v: s.car_state.__setitem__('climate_on', True),
+        'climate_turn_off': lambda s, v: s.car_state.__setitem__('climate_on', False),
+        'climate_set_temperature': lambda s, v: v and s.car_state.__setitem__('temperature', v),
+        'climate_increase': lambda s, v: s.car_state.__setitem__('temperature', min(s.car_state['temperature'] + 1, 30)),
+        'climate_decrease': lambda s, v: s.car_state.__setitem__('temperature', max(s.car_state['temperature'] - 1, 16)),
+        'infotainment_play': lambda s, v: s.car_state.__setitem__('infotainment_on', True),
+        'infotainment_stop': lambda s, v: s.car_state.__setitem__('infotainment_on', False),
+        'infotainment_set_volume': lambda s, v: v and s.car_state.__setitem__('volume', v),
+        'infotainment_volume_up': lambda s, v: s.car_state.__setitem__('volume', min(s.car_state['volume'] + 10, 100)),
+        'infotainment_volume_down': lambda s, v: s.car_state.__setitem__('volume', max(s.car_state['volume'] - 10, 0)),
+        'lights_turn_on': lambda s, v: s.car_state.__setitem__('lights_on', True),
+        'lights_turn_off': lambda s, v: s.car_state.__setitem__('lights_on', False),
+        'lights_dim': lambda s, v: s.car_state.__setitem__('brightness', max(s.car_state['brightness'] - 20, 0)),
+        'lights_brighten': lambda s, v: s.car_state.__setitem__('brightness', min(s.car_state['brightness'] + 20, 100)),
+        'seats_heat_on': lambda s, v: s.car_state.__setitem__('seats_heated', True),
+        'seats_heat_off': lambda s, v: s.car_state.__setitem__('seats_heated', False),
+        'seats_adjust': lambda s, v: v and s.car_state.__setitem__('seat_position', v)
+    }
+    # Small integer id per known action, used to store the action history as arrays
+    _ACTION_NAMES = tuple(_ACTION_HANDLERS)
+    _ACTION_IDS = {name: i for i, name in enumerate(_ACTION_NAMES)}
+    
     def __init__(self):
-        self.client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+        # Separate connections (and network loop threads) for receiving actions and publishing
+        self._rx_client = mqtt.Client(client_id=f'{MQTT_CLIENT_ID}-rx', protocol=mqtt.MQTTv5, transport="tcp")
+        self._tx_client = mqtt.Client(client_id=f'{MQTT_CLIENT_ID}-tx', protocol=mqtt.MQTTv5, transport="tcp")
         self.setup_mqtt()
         
         # AI State
-        self.session_start = None
+        self.session_start = None  # time.monotonic() of the first action
         self.learning_started = False
         self.learning_complete = False
-        self.action_history = deque(maxlen=50)
+        # Action history as a ring buffer of parallel arrays: action id (-1 = empty/unknown) and value
+        self._h_act = np.full(HISTORY_SIZE, -1, np.int8)
+        self._h_val = np.zeros(HISTORY_SIZE, np.float64)  # 0 when the action carried no value
+        self._h_idx = 0  # Actions recorded so far, next write goes to _h_idx % HISTORY_SIZE
         self.recommendations_sent = 0
         self.last_recommendation_time = None
         self.break_reminder_sent = False
+        self._payload_cache = {}  # (action, value, message) tuples -> encoded recommendations list
+        self._is_night = False
+        self._hour_cache_until = 0  # time.monotonic() after which _is_night is recomputed
+        self._stop = threading.Event()  # Set on shutdown to wake every waiting loop at once
+        # All timed work (learning, break reminder, recommendation rounds) runs on one thread
+        self._sched = sched.scheduler(time.monotonic, time.sleep)
         
         # Car state tracking
         self.car_state = {
@@ -56,9 +194,10 @@ class SimplifiedVehicleAI:
             'preferred_brightness': 80,
             'likes_music': False,
             'likes_warm_seats': False,
-            'common_actions': [],
             'action_sequences': []
         }
+        self._common_actions = []
+        self._prefs_dirty = False  # History changed since common_actions was last built
         
         # Natural language templates
         self.morning_greetings = [
@@ -110,69 +249,100 @@ class SimplifiedVehicleAI:
                 "shall we adjust the seat to your preferred setting?"
             ]
         }
-        
-        print("🚗🤖 Simplified Vehicle AI Started")
-        print(f"Learning Period: {LEARNING_PERIOD} seconds")
-        print(f"Break Reminder: After {BREAK_REMINDER_TIME} seconds")
-        print("-" * 60)
+
+        # Fully formatted "greeting suggestion" messages keyed by (action_key, value),
+        # built once so generating a recommendation is a single table lookup
+        self._msg_cache = {}
+        self._prefixed = {
+            action_key: [f"{greeting} {suggestion}"
+                         for greeting in self.morning_greetings
+                         for suggestion in templates]
+            for action_key, templates in self.suggestions.items()
+            if '{' not in ''.join(templates)
+        }
+
+        log.info("🚗🤖 Simplified Vehicle AI Started")
+        log.info(f"Learning Period: {LEARNING_PERIOD} seconds")
+        log.info(f"Break Reminder: After {BREAK_REMINDER_TIME} seconds")
+        log.info("-" * 60)
         
     def setup_mqtt(self):
         """Setup MQTT connections with retry logic"""
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        self._rx_client.on_connect = self.on_connect
+        self._rx_client.on_message = self.on_message
+        self._tx_client.on_connect = self.on_connect
         
+        # Never let the outgoing queue throttle the recommendation loop
+        self._tx_client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+        self._tx_client.max_queued_messages_set(0)
+        
+        self._connect(self._rx_client)
+        self._connect(self._tx_client)
+    
+    def _connect(self, client):
+        """Connect one client and start its network loop, retrying while the broker is unavailable"""
         max_retries = 10
         retry_delay = 5
         
         for attempt in range(max_retries):
             try:
-                print(f"Attempting to connect to MQTT broker (attempt {attempt + 1}/{max_retries})")
-                self.client.connect(MQTT_HOST, MQTT_PORT, 60)
-                self.client.loop_start()
+                log.info(f"Attempting to connect to MQTT broker (attempt {attempt + 1}/{max_retries})")
+                client.connect(MQTT_HOST, MQTT_PORT, 60)
+                client.loop_start()
                 return
             except Exception as e:
-                print(f"❌ MQTT connection failed (attempt {attempt + 1}): {e}")
+                log.error(f"❌ MQTT connection failed (attempt {attempt + 1}): {e}")
                 if attempt < max_retries - 1:
-                    print(f"Retrying in {retry_delay} seconds...")
+                    log.info(f"Retrying in {retry_delay} seconds...")
                     time.sleep(retry_delay)
                 else:
-                    print("❌ Failed to connect after all retries")
+                    log.error("❌ Failed to connect after all retries")
                     raise
     
-    def on_connect(self, client, userdata, flags, rc):
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         if rc == 0:
-            print("✅ Connected to MQTT broker")
-            client.subscribe('vehicle/actions')
-            print("📡 Subscribed to vehicle/actions")
+            log.info("✅ Connected to MQTT broker")
+            # Send small recommendation packets immediately instead of Nagle-batching them
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if client is self._rx_client:
+                topic = f'$share/{MQTT_SHARED_GROUP}/{ACTIONS_TOPIC}' if MQTT_SHARED_GROUP else ACTIONS_TOPIC
+                client.subscribe(topic)
+                log.info(f"📡 Subscribed to {topic}")
         else:
-            print(f"❌ MQTT connection failed: {rc}")
+            log.error(f"❌ MQTT connection failed: {rc}")
     
     def on_message(self, client, userdata, msg):
         """Handle incoming MQTT messages"""
         try:
             topic = msg.topic
-            data = json.loads(msg.payload.decode())
+            data = orjson.loads(msg.payload)  # Parses the raw bytes, no decode step
             
-            if topic == 'vehicle/actions':
+            if topic == ACTIONS_TOPIC:
                 self.handle_vehicle_action(data)
                 
         except Exception as e:
-            print(f"❌ Error processing message: {e}")
+            log.error("❌ Error processing message: %s", e)
     
     def handle_vehicle_action(self, action_data):
         """Process vehicle actions and learn preferences"""
         action = action_data.get('action', '')
-        timestamp = action_data.get('timestamp', datetime.now().isoformat())
         value = action_data.get('value')
         
-        print(f"🚗 Action: {action}{f' ({value})' if value else ''}")
-        
-        # Add to action history
-        self.action_history.append({
-            'action': action,
-            'timestamp': timestamp,
-            'value': value
-        })
+        # %-style arguments, so the message is only built on the listener thread
+        if value:
+            log.info("🚗 Action: %s (%s)", action, value)
+        else:
+            log.info("🚗 Action: %s", action)
+        
+        # Add to action history, overwriting the oldest slot once the buffer is full. Values are
+        # checked before either array is written; one that is not a finite number is left out
+        history_value = self._history_value(value)
+        if history_value is not None:
+            slot = self._h_idx % HISTORY_SIZE
+            self._h_act[slot] = self._ACTION_IDS.get(action, -1)
+            self._h_val[slot] = history_value
+            self._h_idx += 1
+            self._prefs_dirty = True
         
         # Update car state
         self.update_car_state(action, value)
@@ -184,249 +354,252 @@ class SimplifiedVehicleAI:
         # Learn driver preferences
         self.learn_preferences()
     
+    @staticmethod
+    def _history_value(value):
+        """value as a float for the history buffer (0 for no value), None if it is not a finite number"""
+        if value is None:
+            return 0.0
+        if not isinstance(value, (int, float)):
+            return None
+        try:
+            value = float(value)
+        except OverflowError:  # Ints beyond the float range
+            return None
+        return value if math.isfinite(value) else None
+    
     def update_car_state(self, action, value):
         """Update car state based on action"""
-        if action == 'climate_turn_on':
-            self.car_state['climate_on'] = True
-        elif action == 'climate_turn_off':
-            self.car_state['climate_on'] = False
-        elif action == 'climate_set_temperature' and value:
-            self.car_state['temperature'] = value
-        elif action == 'climate_increase':
-            self.car_state['temperature'] = min(self.car_state['temperature'] + 1, 30)
-        elif action == 'climate_decrease':
-            self.car_state['temperature'] = max(self.car_state['temperature'] - 1, 16)
-        elif action == 'infotainment_play':
-            self.car_state['infotainment_on'] = True
-        elif action == 'infotainment_stop':
-            self.car_state['infotainment_on'] = False
-        elif action == 'infotainment_set_volume' and value:
-            self.car_state['volume'] = value
-        elif action == 'infotainment_volume_up':
-            self.car_state['volume'] = min(self.car_state['volume'] + 10, 100)
-        elif action == 'infotainment_volume_down':
-            self.car_state['volume'] = max(self.car_state['volume'] - 10, 0)
-        elif action == 'lights_turn_on':
-            self.car_state['lights_on'] = True
-        elif action == 'lights_turn_off':
-            self.car_state['lights_on'] = False
-        elif action == 'lights_dim':
-            self.car_state['brightness'] = max(self.car_state['brightness'] - 20, 0)
-        elif action == 'lights_brighten':
-            self.car_state['brightness'] = min(self.car_state['brightness'] + 20, 100)
-        elif action == 'seats_heat_on':
-            self.car_state['seats_heated'] = True
-        elif action == 'seats_heat_off':
-            self.car_state['seats_heated'] = False
-        elif action == 'seats_adjust' and value:
-            self.car_state['seat_position'] = value
+        handler = self._ACTION_HANDLERS.get(action)
+        if handler:
+            handler(self, value)
     
     def start_learning(self):
         """Start the learning process"""
         self.learning_started = True
-        self.session_start = datetime.now()
+        self.session_start = time.monotonic()
         
-        print(f"🧠 Learning started! Will provide recommendations in {LEARNING_PERIOD} seconds")
+        log.info(f"🧠 Learning started! Will provide recommendations in {LEARNING_PERIOD} seconds")
         
-        # Start learning timer
-        threading.Timer(LEARNING_PERIOD, self.complete_learning).start()
-        
-        # Start break reminder timer
-        threading.Timer(BREAK_REMINDER_TIME, self.send_break_reminder).start()
+        # Schedule end of learning and drain the scheduler on a single thread
+        self._sched.enter(LEARNING_PERIOD, 1, self.complete_learning)
+        threading.Thread(target=self._sched.run, daemon=True).start()
     
     def complete_learning(self):
         """Complete learning phase and start recommendations"""
         self.learning_complete = True
-        print("🎓 Learning complete! AI ready to make recommendations")
+        log.info("🎓 Learning complete! AI ready to make recommendations")
         
         # Start recommendation loop
         self.start_recommendation_loop()
     
     def start_recommendation_loop(self):
-        """Start the recommendation generation loop"""
-        def recommendation_loop():
-            while (self.learning_complete and 
-                   self.recommendations_sent < MAX_RECOMMENDATIONS_PER_SESSION):
-                
-                # Wait for cooldown
-                if self.last_recommendation_time:
-                    time_since_last = (datetime.now() - self.last_recommendation_time).total_seconds()
-                    if time_since_last < RECOMMENDATION_INTERVAL:
-                        time.sleep(RECOMMENDATION_INTERVAL - time_since_last)
-                
-                # Generate and send recommendation
-                recommendations = self.generate_recommendations()
-                if recommendations:
-                    self.send_recommendations(recommendations)
-                    self.recommendations_sent += 1
-                    self.last_recommendation_time = datetime.now()
-                
-                # Wait before next recommendation
-                time.sleep(RECOMMENDATION_INTERVAL)
+        """Start the recommendation generation loop on the scheduler thread"""
+        self._sched.enter(0, 1, self._recommendation_round)
+    
+    def _recommendation_round(self):
+        """Send one round of recommendations and schedule the next one"""
+        if (self._stop.is_set() or not self.learning_complete or
+                self.recommendations_sent >= MAX_RECOMMENDATIONS_PER_SESSION):
+            return
+        
+        # Break reminder rides along with the rounds, it is a one-shot guarded by its flag
+        if not self.break_reminder_sent and self.get_session_duration() > BREAK_REMINDER_TIME:
+            self.send_break_reminder()
+        
+        # Generate and send recommendation
+        recommendations = self.generate_recommendations()
+        if recommendations:
+            self.send_recommendations(recommendations)
+            self.recommendations_sent += 1
+            self.last_recommendation_time = time.monotonic()
         
-        threading.Thread(target=recommendation_loop, daemon=True).start()
+        # Wait before next recommendation
+        self._sched.enter(RECOMMENDATION_INTERVAL, 1, self._recommendation_round)
+    
+    def history_length(self):
+        """Number of actions currently held in the history buffer"""
+        return min(self._h_idx, HISTORY_SIZE)
     
     def learn_preferences(self):
         """Learn driver preferences from action history"""
-        if len(self.action_history) < 3:
+        if self.history_length() < 3:
             return
         
-        actions = [act['action'] for act in self.action_history]
-        
-        # Learn temperature preference
-        temp_actions = [act for act in self.action_history 
-                       if act['action'] == 'climate_set_temperature' and act['value']]
-        if temp_actions:
-            temps = [act['value'] for act in temp_actions]
-            self.driver_preferences['preferred_temperature'] = sum(temps) // len(temps)
-        
-        # Learn volume preference
-        vol_actions = [act for act in self.action_history 
-                      if act['action'] == 'infotainment_set_volume' and act['value']]
-        if vol_actions:
-            vols = [act['value'] for act in vol_actions]
-            self.driver_preferences['preferred_volume'] = sum(vols) // len(vols)
-        
-        # Learn seat position preference
-        seat_actions = [act for act in self.action_history 
-                       if act['action'] == 'seats_adjust' and act['value']]
-        if seat_actions:
-            positions = [act['value'] for act in seat_actions]
-            self.driver_preferences['preferred_seat_position'] = sum(positions) // len(positions)
+        ids = self._ACTION_IDS
+        temp, vol, seat, likes_music, likes_warm = _reduce_prefs(
+            self._h_act, self._h_val,
+            ids['climate_set_temperature'], ids['infotainment_set_volume'], ids['seats_adjust'],
+            ids['infotainment_play'], ids['seats_heat_on'])
+        
+        # Learn temperature, volume and seat position preferences (only actions that carried a value)
+        if temp != -1:
+            self.driver_preferences['preferred_temperature'] = int(temp)
+        if vol != -1:
+            self.driver_preferences['preferred_volume'] = int(vol)
+        if seat != -1:
+            self.driver_preferences['preferred_seat_position'] = int(seat)
         
         # Learn behavior patterns
-        if 'infotainment_play' in actions:
+        if likes_music:
             self.driver_preferences['likes_music'] = True
         
-        if 'seats_heat_on' in actions:
+        if likes_warm:
             self.driver_preferences['likes_warm_seats'] = True
-        
-        # Learn common actions
-        action_counts = Counter(actions)
-        self.driver_preferences['common_actions'] = [
-            action for action, count in action_counts.items() if count >= 2
-        ]
     
+    @property
+    def common_actions(self):
+        """Actions seen at least twice in the history, rebuilt only when read after new actions"""
+        if self._prefs_dirty and self.history_length() >= 3:
+            h_act = self._h_act
+            action_counts = np.bincount(h_act[h_act >= 0], minlength=len(self._ACTION_NAMES))
+            self._common_actions = [self._ACTION_NAMES[i] for i in np.flatnonzero(action_counts >= 2)]
+            self._prefs_dirty = False
+        return self._common_actions
+    
+    def _suggest(self, action_key, roll, **values):
+        """Pick a greeting + suggestion using the low 16 bits of roll, formatting templates once per value"""
+        if not values:
+            messages = self._prefixed[action_key]
+            return messages[(roll & 0xFFFF) % len(messages)]
+
+        cache_key = (action_key, tuple(values.values()))
+        messages = self._msg_cache.get(cache_key)
+        if messages is None:
+            messages = [f"{greeting} {suggestion.format(**values)}"
+                        for greeting in self.morning_greetings
+                        for suggestion in self.suggestions[action_key]]
+            self._msg_cache[cache_key] = messages
+        return messages[(roll & 0xFFFF) % len(messages)]
+
     def generate_recommendations(self):
         """Generate natural language recommendations"""
         recommendations = []
-        recent_actions = [act['action'] for act in list(self.action_history)[-5:]]
+        append = recommendations.append
+        suggest = self._suggest
+        # One RNG call for the whole batch, each suggestion below reads its own 16-bit slice
+        rolls = random.getrandbits(16 * 6)
+        
+        # Read state and preferences into locals once
+        cs = self.car_state
+        dp = self.driver_preferences
+        climate_on = cs['climate_on']
+        temp_now = cs['temperature']
+        infotainment_on = cs['infotainment_on']
+        vol_now = cs['volume']
+        pref_temp = dp['preferred_temperature']
+        pref_vol = dp['preferred_volume']
+        pref_seat = dp['preferred_seat_position']
         
         # Don't recommend recently performed actions
-        recent_action_set = set(recent_actions[-3:])
+        end = self._h_idx % HISTORY_SIZE
+        if end >= 3:
+            recent_ids = self._h_act[end - 3:end].tolist()  # Contiguous 3-slot view of the tail
+        else:
+            recent_ids = self._h_act[[end - 3, end - 2, end - 1]].tolist()  # Tail wraps, negative indices read the end
+        names = self._ACTION_NAMES
+        recent_action_set = {names[i] for i in recent_ids if i >= 0}
         
         # Climate recommendations
-        if (not self.car_state['climate_on'] and 
+        if (not climate_on and 
             'climate_turn_on' not in recent_action_set):
             
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['climate_turn_on'])
-            message = f"{greeting} {suggestion}"
+            message = suggest('climate_turn_on', rolls)
             
-            recommendations.append({
+            append({
                 'action': 'climate_turn_on',
                 'message': message,
                 'value': None
             })
         
         # Temperature adjustment
-        if (self.car_state['climate_on'] and 
-            self.driver_preferences['preferred_temperature'] != self.car_state['temperature'] and
+        if (climate_on and 
+            pref_temp != temp_now and
             'climate_set_temperature' not in recent_action_set):
             
-            temp = self.driver_preferences['preferred_temperature']
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['climate_set_temperature']).format(temp=temp)
-            message = f"{greeting} {suggestion}"
+            message = suggest('climate_set_temperature', rolls >> 16, temp=pref_temp)
             
-            recommendations.append({
+            append({
                 'action': 'climate_set_temperature',
                 'message': message,
-                'value': temp
+                'value': pref_temp
             })
         
         # Music recommendations
-        if (not self.car_state['infotainment_on'] and 
-            self.driver_preferences['likes_music'] and
+        if (not infotainment_on and 
+            dp['likes_music'] and
             'infotainment_play' not in recent_action_set):
             
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['infotainment_play'])
-            message = f"{greeting} {suggestion}"
+            message = suggest('infotainment_play', rolls >> 32)
             
-            recommendations.append({
+            append({
                 'action': 'infotainment_play',
                 'message': message,
                 'value': None
             })
         
         # Volume adjustment
-        if (self.car_state['infotainment_on'] and 
-            self.driver_preferences['preferred_volume'] != self.car_state['volume'] and
+        if (infotainment_on and 
+            pref_vol != vol_now and
             'infotainment_set_volume' not in recent_action_set):
             
-            vol = self.driver_preferences['preferred_volume']
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['infotainment_set_volume']).format(vol=vol)
-            message = f"{greeting} {suggestion}"
+            message = suggest('infotainment_set_volume', rolls >> 48, vol=pref_vol)
             
-            recommendations.append({
+            append({
                 'action': 'infotainment_set_volume',
                 'message': message,
-                'value': vol
+                'value': pref_vol
             })
         
         # Lighting recommendations (time-based)
-        current_hour = datetime.now().hour
-        if current_hour >= 18 or current_hour <= 6:  # Evening/night
-            if (not self.car_state['lights_on'] and 
+        now = time.monotonic()
+        if now >= self._hour_cache_until:  # The hour only needs checking once a minute
+            current_hour = datetime.now().hour
+            self._is_night = current_hour >= 18 or current_hour <= 6
+            self._hour_cache_until = now + 60
+        if self._is_night:  # Evening/night
+            if (not cs['lights_on'] and 
                 'lights_turn_on' not in recent_action_set):
                 
                 message = "It's getting dark, would you like me to turn on the ambient lights for a cozy atmosphere?"
-                recommendations.append({
+                append({
                     'action': 'lights_turn_on',
                     'message': message,
                     'value': None
                 })
         else:  # Day time
-            if (self.car_state['lights_on'] and 
+            if (cs['lights_on'] and 
                 'lights_turn_off' not in recent_action_set):
                 
                 message = "It's bright outside, would you like me to turn off the ambient lights to save energy?"
-                recommendations.append({
+                append({
                     'action': 'lights_turn_off',
                     'message': message,
                     'value': None
                 })
         
         # Seat heating recommendations
-        if (not self.car_state['seats_heated'] and 
-            self.driver_preferences['likes_warm_seats'] and
+        if (not cs['seats_heated'] and 
+            dp['likes_warm_seats'] and
             'seats_heat_on' not in recent_action_set):
             
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['seats_heat_on'])
-            message = f"{greeting} {suggestion}"
+            message = suggest('seats_heat_on', rolls >> 64)
             
-            recommendations.append({
+            append({
                 'action': 'seats_heat_on',
                 'message': message,
                 'value': None
             })
         
         # Seat position adjustment
-        if (self.driver_preferences['preferred_seat_position'] != self.car_state['seat_position'] and
+        if (pref_seat != cs['seat_position'] and
             'seats_adjust' not in recent_action_set):
             
-            pos = self.driver_preferences['preferred_seat_position']
-            greeting = random.choice(self.morning_greetings)
-            suggestion = random.choice(self.suggestions['seats_adjust']).format(pos=pos)
-            message = f"{greeting} {suggestion}"
+            message = suggest('seats_adjust', rolls >> 80, pos=pref_seat)
             
-            recommendations.append({
+            append({
                 'action': 'seats_adjust',
                 'message': message,
-                'value': pos
+                'value': pref_seat
             })
         
         # Return top 2 recommendations
@@ -446,93 +619,94 @@ class SimplifiedVehicleAI:
             
             message = random.choice(break_messages)
             
-            recommendation_data = {
-                'type': 'ai_suggestion',
-                'recommendations': [{
+            try:
+                payload = _encode_payload([{
                     'action': 'take_break',
                     'message': message,
                     'value': None
-                }],
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            try:
-                self.client.publish('vehicle/recommendations', json.dumps(recommendation_data))
-                print(f"\n🛑 BREAK REMINDER SENT:")
-                print(f"   • {message}")
-                print("-" * 60)
+                }])
+                self._tx_client.publish(RECOMMENDATIONS_TOPIC, payload,
+                                    qos=RECOMMENDATIONS_QOS, retain=False)
+                log.info(f"\n🛑 BREAK REMINDER SENT:\n   • {message}\n" + "-" * 60)
             except Exception as e:
-                print(f"❌ Error sending break reminder: {e}")
+                log.error(f"❌ Error sending break reminder: {e}")
     
     def send_recommendations(self, recommendations):
         """Send recommendations via MQTT"""
         if not recommendations:
             return
         
-        recommendation_data = {
-            'type': 'ai_suggestion',
-            'recommendations': recommendations,
-            'timestamp': datetime.now().isoformat()
-        }
-        
         try:
-            message = json.dumps(recommendation_data)
-            self.client.publish('vehicle/recommendations', message)
+            # Identical recommendations reuse their encoded list, only the timestamp is new per send
+            key = tuple((rec['action'], rec['value'], rec['message']) for rec in recommendations)
+            encoded = self._payload_cache.get(key)
+            if encoded is None:
+                encoded = orjson.dumps(recommendations)
+                if len(self._payload_cache) >= PAYLOAD_CACHE_SIZE:
+                    del self._payload_cache[next(iter(self._payload_cache))]  # Drop the oldest entry
+                self._payload_cache[key] = encoded
+            message = _wrap_payload(encoded)
+            # publish() only queues the message for the network loop, don't wait on it
+            self._tx_client.publish(RECOMMENDATIONS_TOPIC, message, qos=RECOMMENDATIONS_QOS, retain=False)
             
-            print(f"\n🤖 RECOMMENDATION SENT #{self.recommendations_sent + 1}:")
-            for rec in recommendations:
-                print(f"   • {rec['message']}")
-            print("-" * 60)
+            lines = [f"\n🤖 RECOMMENDATION SENT #{self.recommendations_sent + 1}:"]
+            lines.extend(f"   • {rec['message']}" for rec in recommendations)
+            lines.append("-" * 60)
+            log.info("\n".join(lines))
             
         except Exception as e:
-            print(f"❌ Error sending recommendation: {e}")
+            log.error(f"❌ Error sending recommendation: {e}")
     
     def get_session_duration(self):
         """Get session duration in seconds"""
-        if not self.session_start:
+        if self.session_start is None:
             return 0
-        return int((datetime.now() - self.session_start).total_seconds())
+        return int(time.monotonic() - self.session_start)
+    
+    def _log_status(self):
+        """Log a one-line status summary once a session has started"""
+        if self.session_start is None:
+            return
+        duration = self.get_session_duration()
+        actions = self.history_length()
+        phase = "Ready" if self.learning_complete else ("Learning" if self.learning_started else "Waiting")
+        log.info("📊 Status: %s | Duration: %ss | Actions: %s | Recommendations: %s",
+                 phase, duration, actions, self.recommendations_sent)
     
     def run(self):
         """Run the AI system"""
-        print("🚀 Simplified AI System running...")
-        print("Use the dashboard to interact with the vehicle")
-        print("Press Ctrl+C to stop")
+        log.info("🚀 Simplified AI System running...")
+        log.info("Use the dashboard to interact with the vehicle")
+        log.info("Press Ctrl+C to stop")
         
         try:
-            while True:
-                time.sleep(1)
-                
-                # Print status every 30 seconds
-                if self.session_start and self.get_session_duration() % 30 == 0:
-                    duration = self.get_session_duration()
-                    actions = len(self.action_history)
-                    phase = "Ready" if self.learning_complete else ("Learning" if self.learning_started else "Waiting")
-                    print(f"📊 Status: {phase} | Duration: {duration}s | Actions: {actions} | Recommendations: {self.recommendations_sent}")
+            # Print status every 30 seconds, sleeping until then instead of polling
+            while not self._stop.wait(30):
+                self._log_status()
                     
         except KeyboardInterrupt:
-            print(f"\n🛑 AI System stopped")
-            print(f"Session Summary:")
-            print(f"  • Duration: {self.get_session_duration()}s")
-            print(f"  • Actions processed: {len(self.action_history)}")
-            print(f"  • Recommendations sent: {self.recommendations_sent}")
-            print(f"  • Learned preferences: {len([k for k, v in self.driver_preferences.items() if v and k != 'common_actions'])}")
+            self._stop.set()
+            log.info(f"\n🛑 AI System stopped")
+            log.info(f"Session Summary:")
+            log.info(f"  • Duration: {self.get_session_duration()}s")
+            log.info(f"  • Actions processed: {self.history_length()}")
+            log.info(f"  • Recommendations sent: {self.recommendations_sent}")
+            log.info(f"  • Learned preferences: {len([k for k, v in self.driver_preferences.items() if v])}")
         
         finally:
-            self.client.loop_stop()
-            self.client.disconnect()
+            for client in (self._rx_client, self._tx_client):
+                client.loop_stop()
+                client.disconnect()
 
 if __name__ == "__main__":
-    print("🚀 Starting Simplified Vehicle AI...")
-    print(f"MQTT Host: {MQTT_HOST}")
-    print(f"MQTT Port: {MQTT_PORT}")
-    print("=" * 50)
+    log.info("🚀 Starting Simplified Vehicle AI...")
+    log.info(f"MQTT Host: {MQTT_HOST}")
+    log.info(f"MQTT Port: {MQTT_PORT}")
+    log.info("=" * 50)
     
     try:
         ai_system = SimplifiedVehicleAI()
         ai_system.run()
     except Exception as e:
-        print(f"❌ Fatal error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"❌ Fatal error: {e}")
         raise
\ No newline at end of file
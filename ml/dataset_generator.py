@@ -1,60 +1,285 @@
 import openai
+import asyncio
+import csv
+import hashlib
 import json
-import pandas as pd
+import diskcache
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 import random
+import tiktoken
 import time
-from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from datetime import datetime
+from collections import Counter
+from typing import List, Dict, Any, Iterator, Optional
 import os
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# Batch API configuration
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 30  # Seconds between batch status checks
+
+# Online API configuration
+MAX_CONCURRENT_REQUESTS = 50  # Keep in-flight requests under the RPM limit
+
+# Request packing configuration
+PACK_TOKEN_BUDGET = 12000  # Prompt tokens per sequence request
+REPLY_TOKENS_PER_TRIP = 450  # Rough reply size of one 5-15 action sequence
+MAX_REPLY_TOKENS = 12000  # Keep replies well under the model's output limit
+
+# Response cache configuration
+CACHE_DIR = ".llm_cache"
+PROMPT_CACHE_MIN_TOKENS = 1024  # The API only caches prompt prefixes at least this long
 
 class VehicleAIDatasetGenerator:
-    def __init__(self, api_key: str):
-        """Initialize the dataset generator with OpenAI API key"""
+    def __init__(self, api_key: str, sequence_temperature: float = 0.0, seed: Optional[int] = None):
+        """Initialize the dataset generator with OpenAI API key
+        
+        Sequences default to temperature 0 so repeated (persona, context) pairs
+        can be served from the response cache; pass 0.7 for more varied output.
+        Pass a seed to replay the same contexts and fallback choices on every run,
+        it is also sent with API requests so personas repeat as far as the API allows.
+        """
         openai.api_key = api_key
         self.client = openai.OpenAI(api_key=api_key)
+        self.aclient = openai.AsyncOpenAI(api_key=api_key)
+        self._semaphore = None
+        # Structured outputs need a model that supports json_schema responses
+        self.model = "gpt-4o-mini"
+        self.sequence_temperature = sequence_temperature
+        self.seed = seed
+        
+        # Sequence responses cached on disk by (persona, context, model, temperature)
+        self._cache = diskcache.Cache(CACHE_DIR)
+        self.stats = {"hits": 0, "misses": 0}
+        
+        # Personas of the last generated dataset, indexed by driver_id
+        self._persona_table: List[Dict] = []
+        
+        # Dataset layout, low-cardinality strings are dictionary encoded
+        category = pa.dictionary(pa.int8(), pa.string())
+        self.schema = pa.schema([
+            ('driver_id', pa.int64()),
+            ('trip_id', pa.string()),
+            ('timestamp', pa.timestamp('us')),
+            ('action', category),
+            ('value', pa.string()),
+            ('context_reason', pa.string()),
+            ('weather', category),
+            ('trip_type', category),
+            ('time_of_day', category),
+            ('outside_temperature', pa.int64()),
+            ('trip_duration_minutes', pa.int64()),
+            ('passenger_count', pa.int64()),
+            ('is_weekend', pa.bool_()),
+            ('persona_id', pa.int64())
+        ])
         
         # Define available actions matching your MQTT topics
-        self.actions = [
+        self.actions = (
             "climate_turn_on", "climate_turn_off", "climate_set_temperature",
             "climate_increase", "climate_decrease", "infotainment_play",
             "infotainment_stop", "infotainment_volume_up", "infotainment_volume_down",
             "infotainment_set_volume", "lights_turn_on", "lights_turn_off",
             "lights_dim", "lights_brighten", "seats_heat_on", "seats_heat_off",
             "seats_adjust"
-        ]
+        )
+        
+        self._action_set = frozenset(self.actions)
         
         # Define context variables
-        self.weather_conditions = ["sunny", "rainy", "snowy", "cloudy", "foggy"]
-        self.trip_types = ["commute_work", "commute_home", "leisure", "shopping", "long_trip"]
-        self.times_of_day = ["morning", "afternoon", "evening", "night"]
+        self.weather_conditions = ("sunny", "rainy", "snowy", "cloudy", "foggy")
+        self.trip_types = ("commute_work", "commute_home", "leisure", "shopping", "long_trip")
+        self.times_of_day = ("morning", "afternoon", "evening", "night")
         
-    def generate_driver_persona(self) -> Dict[str, Any]:
-        """Generate a realistic driver persona using OpenAI"""
-        prompt = """Generate a realistic driver persona for a car AI system. Include:
-        - Age range and demographic
-        - Driving habits and preferences
-        - Climate preferences (temperature range, fan usage)
-        - Infotainment preferences (music, volume levels)
-        - Lighting preferences
-        - Seat preferences
-        - Common trip patterns
-        - Personality traits that affect car usage
-        
-        Return as JSON format with clear categories."""
+        # Per-instance generators instead of the shared module-level state, both seeded from seed
+        self._rng = random.Random(seed)
+        self._np_rng = np.random.default_rng(seed)
         
+        # Invariant instructions go first as system messages. Persona prompts are too short
+        # for the API's prompt cache (PROMPT_CACHE_MIN_TOKENS); the sequence prompt carries the
+        # action reference and examples so its byte-identical prefix is long enough to be cached
+        self.persona_system_prompt = (
+            "You generate driver personas for car-AI training data. Each persona includes:\n"
+            "- Age range and demographic\n"
+            "- Driving habits and preferences\n"
+            "- Climate preferences (temperature range, fan usage)\n"
+            "- Infotainment preferences (music, volume levels)\n"
+            "- Lighting preferences\n"
+            "- Seat preferences\n"
+            "- Common trip patterns\n"
+            "- Personality traits that affect car usage\n"
+            "Always reply in JSON format with clear categories."
+        )
+        self.sequence_system_prompt = (
+            "You generate car-AI training data: realistic sequences of car actions a driver performs during a trip.\n"
+            f"Available actions (use these exact names): {', '.join(self.actions)}\n"
+            "You are given one or more drivers, each as a persona followed by their trips, "
+            "one trip context per line prefixed with its [id].\n"
+            "For each trip, generate an independent sequence of 5-15 actions for that trip's driver.\n"
+            "Consider:\n"
+            "- Logical action sequences (e.g., turning on climate before adjusting temperature)\n"
+            "- Driver habits and preferences\n"
+            "- Trip context (weather, time, destination)\n"
+            "- Realistic timing between actions\n"
+            'Always reply as a JSON object {"results": [{"id": <trip id>, "actions": [...]}, ...]} '
+            "with exactly one entry per trip id, with action objects containing:\n"
+            "- action: the exact action name\n"
+            "- timestamp_offset: seconds from trip start\n"
+            "- context_reason: why this action makes sense\n"
+            "- value: any specific value (temperature, volume, etc.), or null\n"
+            "\n"
+            "Trip context fields:\n"
+            "- weather: sunny, rainy, snowy, cloudy or foggy\n"
+            "- trip_type: commute_work, commute_home, leisure, shopping or long_trip\n"
+            "- time_of_day: morning, afternoon, evening or night\n"
+            "- outside_temperature: degrees Celsius, from -10 to 35\n"
+            "- trip_duration_minutes: planned length of the trip, from 5 to 120\n"
+            "- passenger_count: people in the car including the driver, from 1 to 4\n"
+            "- is_weekend: true on Saturday and Sunday\n"
+            "\n"
+            "Action reference (what the car does, and what goes in value):\n"
+            "- climate_turn_on / climate_turn_off: switch the climate system, value null\n"
+            "- climate_set_temperature: set the cabin target, value an integer from 16 to 30 (degrees Celsius)\n"
+            "- climate_increase / climate_decrease: move the target by one degree, value null\n"
+            "- infotainment_play / infotainment_stop: start or stop media playback, value null\n"
+            "- infotainment_set_volume: set the volume, value an integer from 0 to 100\n"
+            "- infotainment_volume_up / infotainment_volume_down: change the volume by 10, value null\n"
+            "- lights_turn_on / lights_turn_off: switch the cabin and exterior lights, value null\n"
+            "- lights_dim / lights_brighten: change the brightness by 20 percent, value null\n"
+            "- seats_heat_on / seats_heat_off: switch seat heating, value null\n"
+            "- seats_adjust: move the driver seat, value an integer position from 1 to 10\n"
+            "\n"
+            "Guidelines for realistic sequences:\n"
+            "- Most actions happen in the first few minutes; later actions react to the trip "
+            "(volume changes on the highway, lights at dusk, climate corrections after the cabin warms up)\n"
+            "- timestamp_offset is strictly increasing within a trip and never exceeds the trip duration in seconds\n"
+            "- A setting is adjusted only after its system is on: climate_turn_on before climate_set_temperature, "
+            "infotainment_play before infotainment_set_volume\n"
+            "- Cold or snowy weather favors seat heating and higher temperatures, hot weather favors lower ones\n"
+            "- Night and evening trips, fog and heavy rain favor lights_turn_on early in the trip\n"
+            "- Drivers with passengers keep the volume lower; long trips have more infotainment actions\n"
+            "- Follow the persona's temperature and volume ranges when choosing values\n"
+            "- Keep context_reason short (under 10 words) and specific to the trip\n"
+            "- Never invent action names and never merge several trips into one entry\n"
+            "\n"
+            "Example input:\n"
+            'Driver persona: {"age_range":"25-35","climate_preference":{"temp_range":[21,23]},'
+            '"infotainment":{"volume_range":[15,25]},"type":"tech_savvy_commuter"}\n'
+            "Trips:\n"
+            '[0] {"weather":"snowy","trip_type":"commute_work","time_of_day":"morning","outside_temperature":-4,'
+            '"trip_duration_minutes":25,"passenger_count":1,"is_weekend":false}\n'
+            '[1] {"weather":"sunny","trip_type":"leisure","time_of_day":"afternoon","outside_temperature":29,'
+            '"trip_duration_minutes":60,"passenger_count":3,"is_weekend":true}\n'
+            "Example output:\n"
+            '{"results": ['
+            '{"id": 0, "actions": ['
+            '{"action": "climate_turn_on", "timestamp_offset": 5, "context_reason": "Cold cabin on a snowy morning", "value": null}, '
+            '{"action": "climate_set_temperature", "timestamp_offset": 12, "context_reason": "Usual comfort temperature", "value": 23}, '
+            '{"action": "seats_heat_on", "timestamp_offset": 20, "context_reason": "Below freezing outside", "value": null}, '
+            '{"action": "lights_turn_on", "timestamp_offset": 30, "context_reason": "Low visibility in snow", "value": null}, '
+            '{"action": "infotainment_play", "timestamp_offset": 60, "context_reason": "Morning news for the commute", "value": null}, '
+            '{"action": "infotainment_set_volume", "timestamp_offset": 70, "context_reason": "Preferred volume", "value": 18}, '
+            '{"action": "seats_heat_off", "timestamp_offset": 900, "context_reason": "Seat is warm now", "value": null}'
+            ']}, '
+            '{"id": 1, "actions": ['
+            '{"action": "climate_turn_on", "timestamp_offset": 8, "context_reason": "Hot car after parking in the sun", "value": null}, '
+            '{"action": "climate_set_temperature", "timestamp_offset": 15, "context_reason": "Cool down quickly", "value": 21}, '
+            '{"action": "infotainment_play", "timestamp_offset": 40, "context_reason": "Music for a weekend drive", "value": null}, '
+            '{"action": "infotainment_set_volume", "timestamp_offset": 50, "context_reason": "Moderate volume with passengers", "value": 15}, '
+            '{"action": "climate_increase", "timestamp_offset": 1200, "context_reason": "Cabin has cooled down", "value": null}, '
+            '{"action": "infotainment_volume_up", "timestamp_offset": 2400, "context_reason": "Highway noise", "value": null}, '
+            '{"action": "infotainment_volume_down", "timestamp_offset": 3300, "context_reason": "Arriving at destination", "value": null}'
+            ']}'
+            ']}'
+        )
+        
+        # Structured output schema so sequence replies are always valid JSON
+        action_schema = {
+            "type": "object",
+            "properties": {
+                "action": {"type": "string", "enum": list(self.actions)},
+                "timestamp_offset": {"type": "integer"},
+                "context_reason": {"type": "string"},
+                "value": {"anyOf": [{"type": "number"}, {"type": "string"}, {"type": "null"}]}
+            },
+            "required": ["action", "timestamp_offset", "context_reason", "value"],
+            "additionalProperties": False
+        }
+        self.sequence_schema = {
+            "name": "trip_sequences",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "results": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": "integer"},
+                                "actions": {"type": "array", "items": action_schema}
+                            },
+                            "required": ["id", "actions"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["results"],
+                "additionalProperties": False
+            }
+        }
+        
+        # Token accounting used to pack trips from several drivers into one request
+        self._encoding = tiktoken.encoding_for_model(self.model)
+        self._system_tokens = len(self._encoding.encode(self.sequence_system_prompt))
+        if self._system_tokens < PROMPT_CACHE_MIN_TOKENS:
+            print(f"Sequence system prompt is {self._system_tokens} tokens, "
+                  f"below the {PROMPT_CACHE_MIN_TOKENS}-token prompt cache minimum")
+        
+    def _persona_request(self, driver_id: int) -> Dict[str, Any]:
+        """Build the chat completion body for one driver's persona"""
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.persona_system_prompt},
+                {"role": "user", "content": f"Generate a realistic driver persona for driver #{driver_id}."}
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.8
+        }
+        if self.seed is not None:
+            # Best-effort determinism on the API side, so seeded runs can hit the sequence cache.
+            # Identical requests with one seed would return one persona, so each driver gets its own
+            request["seed"] = self.seed + driver_id
+        return request
+    
+    def _parse_persona(self, persona_text: str) -> Dict[str, Any]:
+        """Parse a persona response, keeping free-form text if it is not JSON"""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.8
-            )
-            
-            persona_text = response.choices[0].message.content
-            # Try to parse as JSON, if not possible, create structured data
-            try:
-                return json.loads(persona_text)
-            except:
-                return {"description": persona_text, "type": "descriptive"}
+            return orjson.loads(persona_text)
+        except orjson.JSONDecodeError:
+            return {"description": persona_text, "type": "descriptive"}
+    
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        wait=wait_random_exponential(min=1, max=60),
+        stop=stop_after_attempt(6),
+        reraise=True
+    )
+    async def _create_completion(self, request: Dict[str, Any]):
+        """Send one chat completion, bounded by the shared semaphore and retried on 429s"""
+        async with self._semaphore:
+            return await self.aclient.chat.completions.create(**request)
+    
+    async def generate_driver_persona_async(self, driver_id: int) -> Dict[str, Any]:
+        """Generate a realistic driver persona using OpenAI"""
+        try:
+            response = await self._create_completion(self._persona_request(driver_id))
+            return self._parse_persona(response.choices[0].message.content)
                 
         except Exception as e:
             print(f"Error generating persona: {e}")
@@ -80,50 +305,141 @@ class VehicleAIDatasetGenerator:
                 "personality": ["cautious", "comfort-focused", "routine-based"]
             }
         ]
-        return random.choice(personas)
-    
-    def generate_behavior_sequence(self, persona: Dict, context: Dict) -> List[Dict]:
-        """Generate a realistic sequence of driver actions"""
-        prompt = f"""
-        Based on this driver persona: {json.dumps(persona)}
-        And this trip context: {json.dumps(context)}
-        
-        Generate a realistic sequence of 5-15 car actions that this driver would perform.
-        Use these exact action names: {', '.join(self.actions)}
-        
-        Consider:
-        - Logical action sequences (e.g., turning on climate before adjusting temperature)
-        - Driver habits and preferences
-        - Trip context (weather, time, destination)
-        - Realistic timing between actions
-        
-        Return as JSON array with objects containing:
-        - action: the exact action name
-        - timestamp_offset: seconds from trip start
-        - context_reason: why this action makes sense
-        - value: any specific value (temperature, volume, etc.)
+        return self._rng.choice(personas)
+    
+    def _serialize_persona(self, persona: Dict) -> bytes:
+        """Serialize a persona once per driver for prompts and cache keys"""
+        return orjson.dumps(persona, option=orjson.OPT_SORT_KEYS)
+    
+    def _sequence_request(self, prompt: str) -> Dict[str, Any]:
+        """Build the chat completion body for a packed sequences prompt"""
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.sequence_system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": {"type": "json_schema", "json_schema": self.sequence_schema},
+            "temperature": self.sequence_temperature
+        }
+        if self.seed is not None:
+            request["seed"] = self.seed
+        return request
+    
+    def _parse_sequences(self, sequences_text: str, job_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Read the action arrays from a structured sequences response, keyed by trip id"""
+        results = orjson.loads(sequences_text)["results"]
+        # Ignore ids that were not part of this request
+        job_ids = set(job_ids)
+        return {result["id"]: result["actions"] for result in results if result["id"] in job_ids}
+    
+    def _lookup_sequences(self, persona_json: bytes, contexts: List[Dict]):
+        """Return cache keys and cached sequences, with None for contexts that missed"""
+        # Hash everything that determines a response: the persona, model and
+        # temperature prefix once per driver, then each full context on a copy
+        # (duration and passengers shape the sequence and are training features)
+        prefix = hashlib.sha256(orjson.dumps({"model": self.model, "t": self.sequence_temperature}))
+        prefix.update(persona_json)
+        keys = []
+        for context in contexts:
+            key = prefix.copy()
+            key.update(orjson.dumps(context, option=orjson.OPT_SORT_KEYS))
+            keys.append(key.hexdigest())
+        
+        sequences = [self._cache.get(key) for key in keys]
+        misses = sequences.count(None)
+        self.stats["hits"] += len(sequences) - misses
+        self.stats["misses"] += misses
+        return keys, sequences
+    
+    def _plan_sequences(self, personas: List[Dict], contexts: Dict[tuple, Dict], trips_per_driver: int):
+        """Serve trips from the cache and pack the rest into token-bounded prompts
+        
+        Returns the cached sequences, the uncached (driver_id, trip_id) jobs with
+        their cache keys, and (prompt, job_ids) packs covering those jobs.
         """
+        sequences = {}
+        jobs = []
+        job_keys = []
+        persona_jsons = []
+        for driver_id, persona in enumerate(personas):
+            persona_json = self._serialize_persona(persona)
+            persona_jsons.append(persona_json)
+            driver_contexts = [contexts[driver_id, trip_id] for trip_id in range(trips_per_driver)]
+            keys, cached = self._lookup_sequences(persona_json, driver_contexts)
+            
+            # Only ask for the trips that are not cached yet
+            for trip_id, (key, sequence) in enumerate(zip(keys, cached)):
+                if sequence is None:
+                    jobs.append((driver_id, trip_id))
+                    job_keys.append(key)
+                else:
+                    sequences[driver_id, trip_id] = sequence
         
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
-            )
+        return sequences, jobs, job_keys, self._pack_jobs(jobs, persona_jsons, contexts)
+    
+    def _pack_jobs(self, jobs: List[tuple], persona_jsons: List[bytes], contexts: Dict[tuple, Dict]):
+        """Greedily pack jobs into prompts under the prompt and reply token budgets"""
+        packs = []
+        lines = []
+        job_ids = []
+        tokens = self._system_tokens
+        current_driver = None
+        headers = {}
+        
+        for job_id, (driver_id, trip_id) in enumerate(jobs):
+            if driver_id not in headers:
+                header = f"Driver persona: {persona_jsons[driver_id].decode()}\nTrips:"
+                headers[driver_id] = (header, len(self._encoding.encode(header)))
+            header, header_tokens = headers[driver_id]
+            trip_line = f"[{job_id}] {orjson.dumps(contexts[driver_id, trip_id]).decode()}"
+            needed = len(self._encoding.encode(trip_line))
+            if driver_id != current_driver:
+                needed += header_tokens
             
-            sequence_text = response.choices[0].message.content
-            # Extract JSON from response
-            start_idx = sequence_text.find('[')
-            end_idx = sequence_text.rfind(']') + 1
-            if start_idx != -1 and end_idx != -1:
-                json_text = sequence_text[start_idx:end_idx]
-                return json.loads(json_text)
+            # Start a new request when this trip would overflow either budget
+            too_long = tokens + needed > PACK_TOKEN_BUDGET
+            too_many = (len(job_ids) + 1) * REPLY_TOKENS_PER_TRIP > MAX_REPLY_TOKENS
+            if job_ids and (too_long or too_many):
+                packs.append(("\n".join(lines), job_ids))
+                lines, job_ids, tokens = [], [], self._system_tokens
+                if driver_id == current_driver:
+                    needed += header_tokens
+                current_driver = None
+            
+            if driver_id != current_driver:
+                lines.append(header)
+                current_driver = driver_id
+            lines.append(trip_line)
+            job_ids.append(job_id)
+            tokens += needed
+        
+        if job_ids:
+            packs.append(("\n".join(lines), job_ids))
+        return packs
+    
+    def _collect_sequences(self, sequences: Dict[tuple, List[Dict]], jobs: List[tuple],
+                           job_keys: List[str], generated: Dict[int, List[Dict]]) -> Dict[tuple, List[Dict]]:
+        """Add generated sequences to the cached ones and cache them"""
+        for job_id, job in enumerate(jobs):
+            sequence = generated.get(job_id)
+            if sequence is None:
+                # The model skipped this trip, don't cache the fallback
+                sequences[job] = self.create_default_sequence()
             else:
-                return self.create_default_sequence()
+                self._cache[job_keys[job_id]] = sequence
+                sequences[job] = sequence
+        return sequences
+    
+    async def generate_behavior_sequences_async(self, prompt: str, job_ids: List[int]) -> Dict[int, List[Dict]]:
+        """Generate realistic sequences of driver actions for a packed prompt of trips"""
+        try:
+            response = await self._create_completion(self._sequence_request(prompt))
+            return self._parse_sequences(response.choices[0].message.content, job_ids)
                 
         except Exception as e:
-            print(f"Error generating sequence: {e}")
-            return self.create_default_sequence()
+            print(f"Error generating sequences: {e}")
+            return {}
     
     def create_default_sequence(self) -> List[Dict]:
         """Create a default action sequence"""
@@ -140,75 +456,235 @@ class VehicleAIDatasetGenerator:
                 {"action": "climate_turn_on", "timestamp_offset": 25, "context_reason": "Defrosting", "value": None}
             ]
         ]
-        return random.choice(sequences)
+        return self._rng.choice(sequences)
     
     def generate_trip_context(self) -> Dict[str, Any]:
         """Generate random trip context"""
         return {
-            "weather": random.choice(self.weather_conditions),
-            "trip_type": random.choice(self.trip_types),
-            "time_of_day": random.choice(self.times_of_day),
-            "outside_temperature": random.randint(-10, 35),
-            "trip_duration_minutes": random.randint(5, 120),
-            "passenger_count": random.randint(1, 4),
-            "is_weekend": random.choice([True, False])
+            "weather": self._rng.choice(self.weather_conditions),
+            "trip_type": self._rng.choice(self.trip_types),
+            "time_of_day": self._rng.choice(self.times_of_day),
+            "outside_temperature": self._rng.randint(-10, 35),
+            "trip_duration_minutes": self._rng.randint(5, 120),
+            "passenger_count": self._rng.randint(1, 4),
+            "is_weekend": self._rng.choice((True, False))
         }
     
-    def generate_dataset(self, num_drivers: int = 50, trips_per_driver: int = 20) -> pd.DataFrame:
-        """Generate complete dataset"""
+    def _run_batch(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        """Submit chat completion bodies as one Batch job and return replies by custom_id"""
+        lines = [
+            orjson.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body})
+            for custom_id, body in requests.items()
+        ]
+        
+        try:
+            batch_file = self.client.files.create(
+                file=("batch.jsonl", b"\n".join(lines)),
+                purpose="batch"
+            )
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=BATCH_COMPLETION_WINDOW
+            )
+            print(f"Submitted batch {batch.id} with {len(lines)} requests")
+            
+            # Wait for the batch to finish
+            while batch.status not in ("completed", "failed", "expired", "cancelled"):
+                time.sleep(BATCH_POLL_INTERVAL)
+                batch = self.client.batches.retrieve(batch.id)
+            
+            if batch.status != "completed" or not batch.output_file_id:
+                print(f"Batch {batch.id} finished with status {batch.status}")
+                return {}
+            
+            output = self.client.files.content(batch.output_file_id).text
+        except Exception as e:
+            print(f"Error running batch: {e}")
+            return {}
+        
+        # Collect successful replies keyed by custom_id
+        replies = {}
+        for line in output.splitlines():
+            result = orjson.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                replies[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return replies
+    
+    def _generate_batch(self, num_drivers: int, trips_per_driver: int):
+        """Generate personas, contexts and sequences with two Batch jobs"""
+        # Phase 1: driver personas
+        persona_replies = self._run_batch({
+            f"persona_{driver_id}": self._persona_request(driver_id) for driver_id in range(num_drivers)
+        })
+        personas = []
+        for driver_id in range(num_drivers):
+            persona_text = persona_replies.get(f"persona_{driver_id}")
+            if persona_text is None:
+                personas.append(self.create_default_persona())
+            else:
+                personas.append(self._parse_persona(persona_text))
+        
+        # Phase 2: behavior sequences, packing trips from several drivers per request
+        contexts = self._trip_contexts(num_drivers, trips_per_driver)
+        sequences, jobs, job_keys, packs = self._plan_sequences(personas, contexts, trips_per_driver)
+        
+        sequence_replies = self._run_batch({
+            f"sequences_{i}": self._sequence_request(prompt) for i, (prompt, _) in enumerate(packs)
+        }) if packs else {}
+        generated = {}
+        for i, (_, job_ids) in enumerate(packs):
+            try:
+                generated.update(self._parse_sequences(sequence_replies.get(f"sequences_{i}", ""), job_ids))
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                pass
+        
+        return personas, contexts, self._collect_sequences(sequences, jobs, job_keys, generated)
+    
+    async def _generate_online(self, num_drivers: int, trips_per_driver: int):
+        """Generate personas, contexts and sequences with concurrent API calls"""
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        contexts = self._trip_contexts(num_drivers, trips_per_driver)
+        
+        # Personas come first since requests pack trips from several drivers
+        personas = await asyncio.gather(*[
+            self.generate_driver_persona_async(driver_id) for driver_id in range(num_drivers)
+        ])
+        
+        sequences, jobs, job_keys, packs = self._plan_sequences(personas, contexts, trips_per_driver)
+        results = await asyncio.gather(*[
+            self.generate_behavior_sequences_async(prompt, job_ids) for prompt, job_ids in packs
+        ])
+        generated = {}
+        for result in results:
+            generated.update(result)
+        
+        return personas, contexts, self._collect_sequences(sequences, jobs, job_keys, generated)
+    
+    def generate_trip_contexts_bulk(self, n: int) -> Dict[str, np.ndarray]:
+        """Generate n random trip contexts at once, as one array per field"""
+        rng = self._np_rng
+        return {
+            "weather": rng.choice(self.weather_conditions, n),
+            "trip_type": rng.choice(self.trip_types, n),
+            "time_of_day": rng.choice(self.times_of_day, n),
+            "outside_temperature": rng.integers(-10, 36, n),
+            "trip_duration_minutes": rng.integers(5, 121, n),
+            "passenger_count": rng.integers(1, 5, n),
+            "is_weekend": rng.integers(0, 2, n).astype(bool)
+        }
+    
+    def _trip_contexts(self, num_drivers: int, trips_per_driver: int) -> Dict[tuple, Dict[str, Any]]:
+        """Sample every trip context in bulk and key them by (driver_id, trip_id)"""
+        bulk = self.generate_trip_contexts_bulk(num_drivers * trips_per_driver)
+        # Plain Python values so contexts can be serialized into prompts and cache keys
+        columns = {name: values.tolist() for name, values in bulk.items()}
+        return {
+            (driver_id, trip_id): {
+                name: values[driver_id * trips_per_driver + trip_id] for name, values in columns.items()
+            }
+            for driver_id in range(num_drivers)
+            for trip_id in range(trips_per_driver)
+        }
+    
+    def generate_dataset(self, num_drivers: int = 50, trips_per_driver: int = 20,
+                         use_batch: bool = True) -> Iterator[pa.Table]:
+        """Generate complete dataset, yielding one table of rows per driver"""
         print(f"Generating dataset with {num_drivers} drivers and {trips_per_driver} trips each...")
         
-        dataset = []
+        # The Batch API is half the price and not bound by per-request latency,
+        # the online path is kept for quick iteration
+        if use_batch:
+            personas, contexts, sequences = self._generate_batch(num_drivers, trips_per_driver)
+        else:
+            personas, contexts, sequences = asyncio.run(self._generate_online(num_drivers, trips_per_driver))
+        print(f"Sequence cache: {self.stats['hits']} hits, {self.stats['misses']} misses")
+        
+        # Rows only reference their persona, the personas are saved separately
+        self._persona_table = list(personas)
         
         for driver_id in range(num_drivers):
-            print(f"Generating data for driver {driver_id + 1}/{num_drivers}")
-            
-            # Generate driver persona
-            persona = self.generate_driver_persona()
+            # Accumulate column by column instead of one dict per row
+            columns = {name: [] for name in self.schema.names}
+            offsets = []
+            actions_per_trip = []
             
             for trip_id in range(trips_per_driver):
-                # Generate trip context
-                context = self.generate_trip_context()
+                context = contexts[driver_id, trip_id]
+                actions = sequences[driver_id, trip_id]
                 
-                # Generate behavior sequence
-                actions = self.generate_behavior_sequence(persona, context)
-                
-                # Create base timestamp
-                base_time = datetime.now() - timedelta(days=random.randint(0, 365))
-                
-                # Add each action to dataset
+                # Add each action to dataset, skipping any the model made up
+                num_actions = 0
                 for action_data in actions:
-                    record = {
-                        'driver_id': driver_id,
-                        'trip_id': f"{driver_id}_{trip_id}",
-                        'timestamp': base_time + timedelta(seconds=action_data.get('timestamp_offset', 0)),
-                        'action': action_data['action'],
-                        'value': action_data.get('value'),
-                        'context_reason': action_data.get('context_reason', ''),
-                        'weather': context['weather'],
-                        'trip_type': context['trip_type'],
-                        'time_of_day': context['time_of_day'],
-                        'outside_temperature': context['outside_temperature'],
-                        'trip_duration_minutes': context['trip_duration_minutes'],
-                        'passenger_count': context['passenger_count'],
-                        'is_weekend': context['is_weekend'],
-                        'driver_persona': json.dumps(persona)
-                    }
-                    dataset.append(record)
+                    if action_data.get('action') not in self._action_set:
+                        continue
+                    num_actions += 1
+                    value = action_data.get('value')
+                    columns['trip_id'].append(f"{driver_id}_{trip_id}")
+                    columns['action'].append(action_data['action'])
+                    columns['value'].append(None if value is None else str(value))
+                    columns['context_reason'].append(action_data.get('context_reason', ''))
+                    offsets.append(action_data.get('timestamp_offset', 0))
                 
-                # Add small delay to avoid rate limiting
-                time.sleep(0.1)
-        
-        return pd.DataFrame(dataset)
-    
-    def save_dataset(self, df: pd.DataFrame, filename: str = "vehicle_ai_dataset.csv"):
-        """Save dataset to CSV"""
-        df.to_csv(filename, index=False)
-        print(f"Dataset saved to {filename}")
-        print(f"Total records: {len(df)}")
-        print(f"Unique drivers: {df['driver_id'].nunique()}")
-        print(f"Unique trips: {df['trip_id'].nunique()}")
-        print(f"Action distribution:\n{df['action'].value_counts()}")
+                # Trip-level fields are the same for every action of the trip
+                actions_per_trip.append(num_actions)
+                for name, context_value in context.items():
+                    columns[name].extend([context_value] * num_actions)
+            
+            # Timestamps are a random base time per trip plus each action's offset,
+            # computed as datetime64 arrays instead of one datetime per row
+            base_times = np.datetime64(datetime.now(), 'us') - \
+                self._np_rng.integers(0, 366, trips_per_driver) * np.timedelta64(1, 'D')
+            columns['timestamp'] = np.repeat(base_times, actions_per_trip) + \
+                np.asarray(offsets, dtype=np.int64) * np.timedelta64(1, 's')
+            
+            columns['driver_id'] = [driver_id] * len(columns['action'])
+            columns['persona_id'] = columns['driver_id']
+            
+            yield pa.Table.from_pydict(columns, schema=self.schema)
+    
+    def save_dataset(self, tables: Iterator[pa.Table], path: str = "vehicle_ai_dataset.parquet",
+                     personas_filename: str = "personas.json"):
+        """Stream dataset tables to Parquet (or CSV) and the personas they reference to JSON"""
+        total_records = 0
+        drivers = set()
+        trips = set()
+        action_counts = Counter()
+        
+        def tally(table: pa.Table):
+            # Keep running tallies for the summary instead of the whole dataset
+            nonlocal total_records
+            total_records += table.num_rows
+            drivers.update(table.column('driver_id').to_pylist())
+            trips.update(table.column('trip_id').to_pylist())
+            action_counts.update(table.column('action').to_pylist())
+        
+        # Write each driver as it is produced so only one driver is held in memory
+        if path.endswith(".parquet"):
+            with pq.ParquetWriter(path, self.schema) as writer:
+                for table in tables:
+                    writer.write_table(table)
+                    tally(table)
+        else:
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(self.schema.names)
+                for table in tables:
+                    writer.writerows(zip(*table.to_pydict().values()))
+                    tally(table)
+        
+        with open(personas_filename, 'w') as f:
+            json.dump({persona_id: persona for persona_id, persona in enumerate(self._persona_table)}, f, indent=2)
+        
+        print(f"Dataset saved to {path}")
+        print(f"Personas saved to {personas_filename}")
+        print(f"Total records: {total_records}")
+        print(f"Unique drivers: {len(drivers)}")
+        print(f"Unique trips: {len(trips)}")
+        print("Action distribution:")
+        for action, count in action_counts.most_common():
+            print(f"  {action}: {count}")
 
 # Usage example
 if __name__ == "__main__":
@@ -223,11 +699,12 @@ if __name__ == "__main__":
     dataset = generator.generate_dataset(num_drivers=10, trips_per_driver=5)
     
     # Save dataset
-    generator.save_dataset(dataset, "vehicle_ai_training_dataset.csv")
+    generator.save_dataset(dataset, "vehicle_ai_training_dataset.parquet")
     
     # Display sample data
+    dataset = pq.read_table("vehicle_ai_training_dataset.parquet")
     print("\nSample data:")
-    print(dataset.head(10))
+    print(dataset.slice(0, 10))
     
     print("\nDataset shape:", dataset.shape)
-    print("\nColumns:", list(dataset.columns))
+    print("\nColumns:", dataset.column_names)
@@ -1,88 +1,197 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import LabelEncoder
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split
-import pickle
+import joblib
+import os
+import queue
+import threading
+import time
 import json
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
+from concurrent.futures import Future
+from functools import lru_cache
+
+# Encoded feature rows whose predictions are kept, contexts repeat a lot within a drive
+PREDICTION_CACHE_SIZE = 4096
+# Concurrent requests are scored together: up to MAX_BATCH rows, waiting at most MAX_WAIT_MS for more
+MAX_BATCH = 64
+MAX_WAIT_MS = 5
+# Types for the training CSV columns, parsed while the file is tokenized instead of converted afterwards
+TRAINING_COLUMN_TYPES = {
+    'driver_id': pa.int32(),
+    'timestamp': pa.timestamp('us'),
+    'outside_temperature': pa.float32(),
+    'passenger_count': pa.int8(),
+    'is_weekend': pa.bool_()
+}
+# Explanation templates for actions with a specific reason, filled from the request context
+_EXPL = {
+    'climate_turn_on': "You usually turn on climate when it's {weather} weather",
+    'seats_heat_on': "You typically use seat heating when temperature is {outside_temperature}°C",
+    'infotainment_play': "You usually play music during {trip_type} trips",
+    'lights_turn_on': "You often turn on lights during {time_of_day} drives"
+}
+
+try:
+    from cuml import ForestInference
+except ImportError:  # cuML is optional, predictions fall back to sklearn's predict_proba
+    ForestInference = None
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional, kernels then run as plain Python
+    NUMBA_AVAILABLE = False
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+@njit(cache=True)
+def _topk_filter(probs, k, thresh):
+    """Indices and confidences of the k most likely classes above thresh, best first"""
+    probs = probs.copy()
+    indices = np.empty(k, np.int64)
+    confidences = np.empty(k, np.float64)
+    n = 0
+    # k selection passes over the classes instead of sorting all of them
+    for _ in range(min(k, probs.shape[0])):
+        best = np.argmax(probs)
+        if probs[best] <= thresh:
+            break
+        indices[n] = best
+        confidences[n] = probs[best]
+        probs[best] = -1.0
+        n += 1
+    return indices[:n], confidences[:n]
+
+@njit(cache=True)
+def _fill_prev(driver_ids, actions, none_id):
+    """Previous and second previous action code per row (rows sorted by driver, then time)"""
+    n = len(driver_ids)
+    prev_1 = np.full(n, none_id, np.int32)
+    prev_2 = np.full(n, none_id, np.int32)
+    for i in range(1, n):
+        if driver_ids[i] == driver_ids[i - 1]:
+            prev_1[i] = actions[i - 1]
+            if i >= 2 and driver_ids[i] == driver_ids[i - 2]:
+                prev_2[i] = actions[i - 2]
+    return prev_1, prev_2
 
 class VehicleRecommendationEngine:
     def __init__(self):
-        self.model = RandomForestClassifier(n_estimators=100, random_state=42)
-        self.label_encoders = {}
-        self.driver_patterns = defaultdict(list)
+        # Histogram-based boosting bins each feature once instead of sorting per split and
+        # already fits on all cores (OpenMP, capped by OMP_NUM_THREADS); each split only scans 70% of the features.
+        # L2 keeps leaf values bounded for actions seen only once or twice, whose near-zero
+        # hessians otherwise blow up the raw scores; train() decides on early stopping
+        self.model = HistGradientBoostingClassifier(
+            max_iter=100, early_stopping=False, l2_regularization=1.0, max_features=0.7, random_state=42
+        )
+        self.fil_model = None  # cuML Forest Inference copy of self.model, when available
+        self.feature_dtype = np.float32  # Narrowest dtype holding every feature, set by train()
+        self.categories = {}  # column -> pd.Index of its values, position is the integer code
+        # Plain dict/list views of the categories for single-value lookups at request time
+        self._enc = {}
+        self._inv_action = []
+        # One row per observed (context, action), columnar across all drivers
+        self.driver_patterns_df = pd.DataFrame()
+        self._driver_rows = {}  # driver_id -> row positions in driver_patterns_df
         self.driver_sequences = defaultdict(list)
         self.is_trained = False
+        # Per-instance cache so it is dropped with the engine and never keys on self
+        self._predict_cached = lru_cache(maxsize=PREDICTION_CACHE_SIZE)(self._predict)
+        # Micro-batching of cache misses, the worker thread starts on the first prediction
+        self._batch_queue = queue.Queue()
+        self._batch_lock = threading.Lock()
+        self._batch_thread = None
+        self._feat_buf = threading.local()  # Per-thread 1 x n_features row reused by _predict
         
     def prepare_features(self, df):
         """Prepare features for training"""
-        # Create categorical encoders
-        categorical_cols = ['weather', 'trip_type', 'time_of_day']
+        # Categorical columns, their codes are the encoded features (the target for 'action')
+        categorical_cols = ['weather', 'trip_type', 'time_of_day', 'action']
         
         for col in categorical_cols:
-            if col not in self.label_encoders:
-                self.label_encoders[col] = LabelEncoder()
-                df[f'{col}_encoded'] = self.label_encoders[col].fit_transform(df[col])
+            if col not in self.categories:
+                df[col] = df[col].astype('category')
+                if not df[col].cat.categories.is_monotonic_increasing:
+                    # Dictionary encoded input (Parquet) keeps first-seen order, sort to match CSV codes
+                    df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+                self.categories[col] = df[col].cat.categories
             else:
-                df[f'{col}_encoded'] = self.label_encoders[col].transform(df[col])
+                df[col] = pd.Categorical(df[col], categories=self.categories[col])
+            df[f'{col}_encoded'] = df[col].cat.codes
         
-        # Create time-based features
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        # Create time-based features (train() already reads timestamps as datetimes)
+        if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
         df['hour'] = df['timestamp'].dt.hour
         df['day_of_week'] = df['timestamp'].dt.dayofweek
         
-        # Create sequence features (last 2 actions)
-        sequence_features = []
-        for driver_id in df['driver_id'].unique():
-            driver_data = df[df['driver_id'] == driver_id].sort_values('timestamp')
-            
-            for i, row in driver_data.iterrows():
-                recent_actions = list(driver_data[driver_data.index < i]['action'].tail(2))
-                
-                # Pad with 'none' if less than 2 previous actions
-                while len(recent_actions) < 2:
-                    recent_actions.insert(0, 'none')
-                
-                sequence_features.append({
-                    'index': i,
-                    'prev_action_1': recent_actions[-1] if len(recent_actions) > 0 else 'none',
-                    'prev_action_2': recent_actions[-2] if len(recent_actions) > 1 else 'none'
-                })
-        
-        seq_df = pd.DataFrame(sequence_features).set_index('index')
-        df = df.join(seq_df)
+        # Create sequence features (last 2 actions per driver in time order, padded with 'none')
+        # Previous actions reuse the action codes, 'none' takes the next free code
+        if 'prev_actions' not in self.categories:
+            self.categories['prev_actions'] = self.categories['action'].append(pd.Index(['none']))
+        none_id = self.categories['prev_actions'].get_loc('none')
+        
+        ordered = df.sort_values(['driver_id', 'timestamp'])
+        action_codes = ordered['action_encoded'].to_numpy()
+        if NUMBA_AVAILABLE:
+            prev_1, prev_2 = _fill_prev(ordered['driver_id'].to_numpy(), action_codes, none_id)
+        else:
+            # Without the compiled kernel, vectorised per-driver shifts beat a Python row loop
+            by_driver = pd.Series(action_codes, index=ordered.index).groupby(ordered['driver_id'])
+            prev_1 = by_driver.shift(1).fillna(none_id).to_numpy(np.int32)
+            prev_2 = by_driver.shift(2).fillna(none_id).to_numpy(np.int32)
+        # Both codes packed into one feature (previous action in the high byte) so a split
+        # can pick out the last-two-actions state directly. Codes come out in sorted order,
+        # the Series index aligns them back to df's rows
+        bigram = (prev_1.astype(np.uint16) << 8) | prev_2.astype(np.uint16)
+        df['prev_bigram'] = pd.Series(bigram, index=ordered.index)
         
         return df
     
     def extract_driver_patterns(self, df):
         """Extract common patterns for each driver"""
-        for driver_id in df['driver_id'].unique():
-            driver_data = df[df['driver_id'] == driver_id]
-            
-            # Pattern 1: Action frequency by context
-            context_patterns = []
-            for _, row in driver_data.iterrows():
-                context = {
-                    'weather': row['weather'],
-                    'trip_type': row['trip_type'],
-                    'time_of_day': row['time_of_day'],
-                    'outside_temperature': row['outside_temperature'],
-                    'action': row['action']
-                }
-                context_patterns.append(context)
-            
-            self.driver_patterns[driver_id] = context_patterns
-            
-            # Pattern 2: Action sequences
-            sequences = driver_data.groupby('trip_id')['action'].apply(list).tolist()
-            self.driver_sequences[driver_id] = sequences
+        # Pattern 1: Action frequency by context
+        context_cols = ['driver_id', 'weather', 'trip_type', 'time_of_day', 'outside_temperature', 'action']
+        self.driver_patterns_df = df[context_cols].reset_index(drop=True)
+        self._driver_rows = self.driver_patterns_df.groupby('driver_id').indices
+        
+        # Pattern 2: Action sequences
+        sequences = defaultdict(list)
+        for (driver_id, _), actions in df.groupby(['driver_id', 'trip_id'])['action'].apply(list).items():
+            sequences[driver_id].append(actions)
+        self.driver_sequences.update(sequences)
+    
+    def get_driver_patterns(self, driver_id):
+        """Context/action rows observed for one driver"""
+        rows = self._driver_rows.get(driver_id)
+        if rows is None:
+            return self.driver_patterns_df.iloc[:0]
+        return self.driver_patterns_df.iloc[rows]
     
     def train(self, csv_file_path):
-        """Train the recommendation model"""
+        """Train the recommendation model from a CSV or Parquet dataset"""
+        # Categories are refit from this dataset, stale ones would give unseen values code -1
+        self.categories = {}
+        
         print("Loading dataset...")
-        df = pd.read_csv(csv_file_path)
+        if csv_file_path.endswith('.parquet'):
+            # The generator's Parquet output already carries typed (and dictionary encoded) columns
+            table = pq.read_table(csv_file_path)
+        else:
+            # pyarrow parses and infers types on all cores, pandas' reader is single-threaded
+            table = pacsv.read_csv(
+                csv_file_path,
+                read_options=pacsv.ReadOptions(use_threads=True),
+                convert_options=pacsv.ConvertOptions(column_types=TRAINING_COLUMN_TYPES)
+            )
+        df = table.to_pandas()
         
         print("Preparing features...")
         df = self.prepare_features(df)
@@ -97,27 +206,34 @@ class VehicleRecommendationEngine:
         ]
         
         # Add previous actions as features
-        prev_action_encoder = LabelEncoder()
-        all_actions = list(df['action'].unique()) + ['none']
-        prev_action_encoder.fit(all_actions)
-        self.label_encoders['prev_actions'] = prev_action_encoder
-        
-        df['prev_action_1_encoded'] = prev_action_encoder.transform(df['prev_action_1'])
-        df['prev_action_2_encoded'] = prev_action_encoder.transform(df['prev_action_2'])
-        
-        feature_cols.extend(['prev_action_1_encoded', 'prev_action_2_encoded'])
-        
-        # Prepare target
-        target_encoder = LabelEncoder()
-        df['action_encoded'] = target_encoder.fit_transform(df['action'])
-        self.label_encoders['action'] = target_encoder
-        
-        # Split data
-        X = df[feature_cols].fillna(0)
-        y = df['action_encoded']
+        feature_cols.append('prev_bigram')
+        
+        # Encoded columns are categories, not ordered values. The bigram has too many distinct
+        # values for a categorical feature and is split as a number (by previous action first)
+        categorical_cols = {'weather_encoded', 'trip_type_encoded', 'time_of_day_encoded'}
+        self.model.set_params(categorical_features=[col in categorical_cols for col in feature_cols])
+        
+        # Every feature is a small integer: narrow each column to the smallest integer type
+        # that holds it (int16 overall on typical data, for the bigram) and copy the columns
+        # straight into one preallocated matrix instead of writing them back into df
+        columns = [pd.to_numeric(df[col], downcast='integer').to_numpy() for col in feature_cols]
+        self.feature_dtype = np.result_type(*columns)
+        X = np.empty((len(df), len(columns)), dtype=self.feature_dtype)
+        for i, column in enumerate(columns):
+            X[:, i] = column
+        y = df['action_encoded'].to_numpy()
         
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
         
+        # Early stopping holds out a stratified validation split, which needs at least two rows
+        # of every action and room for one of each in the split; rare actions would crash fit
+        class_counts = np.bincount(y_train)
+        class_counts = class_counts[class_counts > 0]
+        validation_rows = int(np.ceil(len(y_train) * self.model.validation_fraction))
+        self.model.set_params(
+            early_stopping=bool(class_counts.min() >= 2 and validation_rows >= len(class_counts))
+        )
+        
         print("Training model...")
         self.model.fit(X_train, y_train)
         
@@ -128,6 +244,10 @@ class VehicleRecommendationEngine:
         print(f"Training accuracy: {train_score:.3f}")
         print(f"Test accuracy: {test_score:.3f}")
         
+        self.fil_model = self._build_fil_model()
+        self._build_lookups()
+        self._predict_cached.cache_clear()
+        
         self.is_trained = True
         print("Model training completed!")
         
@@ -146,43 +266,34 @@ class VehicleRecommendationEngine:
         prev_action_1 = padded_actions[-1]
         prev_action_2 = padded_actions[-2]
         
-        # Prepare input features
+        # Prepare input features as a hashable tuple, temperature rounded to whole degrees
         try:
-            features = [
+            features = (
                 driver_id,
-                self.label_encoders['weather'].transform([current_context['weather']])[0],
-                self.label_encoders['trip_type'].transform([current_context['trip_type']])[0],
-                self.label_encoders['time_of_day'].transform([current_context['time_of_day']])[0],
-                current_context['outside_temperature'],
+                self._enc['weather'][current_context['weather']],
+                self._enc['trip_type'][current_context['trip_type']],
+                self._enc['time_of_day'][current_context['time_of_day']],
+                int(round(current_context['outside_temperature'])),
                 current_context.get('passenger_count', 1),
                 current_context.get('is_weekend', False),
                 current_context.get('hour', 12),
                 current_context.get('day_of_week', 0),
-                self.label_encoders['prev_actions'].transform([prev_action_1])[0],
-                self.label_encoders['prev_actions'].transform([prev_action_2])[0]
-            ]
+                (self._enc['prev_actions'][prev_action_1] << 8) | self._enc['prev_actions'][prev_action_2]
+            )
+            top_actions = self._predict_cached(features)
         except KeyError as e:
             return {"error": f"Unknown context value: {e}"}
+        except OverflowError as e:
+            return {"error": f"Context value out of range: {e}"}
         
-        # Get prediction probabilities
-        X = np.array(features).reshape(1, -1)
-        probabilities = self.model.predict_proba(X)[0]
-        
-        # Get top 3 recommendations
-        top_indices = np.argsort(probabilities)[-3:][::-1]
         recommendations = []
-        
-        for idx in top_indices:
-            action = self.label_encoders['action'].inverse_transform([idx])[0]
-            confidence = probabilities[idx]
-            
-            if confidence > 0.1:  # Only recommend if confidence > 10%
-                reason = self._explain_recommendation(driver_id, action, current_context)
-                recommendations.append({
-                    'action': action,
-                    'confidence': float(confidence),
-                    'reason': reason
-                })
+        for action, confidence in top_actions:
+            reason = self._explain_recommendation(driver_id, action, current_context)
+            recommendations.append({
+                'action': action,
+                'confidence': confidence,
+                'reason': reason
+            })
         
         return {
             'recommendations': recommendations,
@@ -190,42 +301,135 @@ class VehicleRecommendationEngine:
             'context': current_context
         }
     
-    def _explain_recommendation(self, driver_id, action, context):
-        """Generate human-readable explanation for recommendation"""
-        explanations = {
-            'climate_turn_on': f"You usually turn on climate when it's {context['weather']} weather",
-            'seats_heat_on': f"You typically use seat heating when temperature is {context['outside_temperature']}°C",
-            'infotainment_play': f"You usually play music during {context['trip_type']} trips",
-            'lights_turn_on': f"You often turn on lights during {context['time_of_day']} drives"
+    def _predict(self, features):
+        """Top 3 (action, confidence) pairs above 10% confidence for one encoded feature row"""
+        # The calling thread waits for its result before reusing the row, and the batch worker
+        # copies it into the stacked batch, so one buffer per thread is enough
+        X = getattr(self._feat_buf, 'arr', None)
+        if X is None or X.dtype != self.feature_dtype or X.shape[1] != len(features):
+            X = self._feat_buf.arr = np.empty((1, len(features)), dtype=self.feature_dtype)
+        
+        # NumPy 1.x silently wraps out-of-range ints written into a narrow integer row
+        if X.dtype.kind in 'iu':
+            bounds = np.iinfo(X.dtype)
+            for value in features:
+                if not bounds.min <= value <= bounds.max:
+                    raise OverflowError(f"{value} does not fit in {X.dtype}")
+        X[0] = features
+        probabilities = self._predict_proba_batched(X)
+        
+        top_indices, confidences = _topk_filter(probabilities, 3, 0.1)
+        return tuple((self._inv_action[idx], float(confidence))
+                     for idx, confidence in zip(top_indices, confidences))
+    
+    def _predict_proba(self, X):
+        """Class probabilities for a feature matrix, through FIL when available"""
+        if self.fil_model is not None:
+            return self.fil_model.predict_proba(X.astype(np.float32))
+        return self.model.predict_proba(X)
+    
+    def _predict_proba_batched(self, X):
+        """Queue one feature row for the batch worker and wait for its probabilities"""
+        with self._batch_lock:
+            if self._batch_thread is None:
+                self._batch_thread = threading.Thread(target=self._batch_worker, daemon=True)
+                self._batch_thread.start()
+        
+        future = Future()
+        self._batch_queue.put((future, X))
+        return future.result()
+    
+    def _batch_worker(self):
+        """Collect queued rows into batches and score each batch with one predict_proba call"""
+        while True:
+            batch = [self._batch_queue.get()]
+            deadline = time.monotonic() + MAX_WAIT_MS / 1000
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                probabilities = self._predict_proba(np.vstack([X for _, X in batch]))
+            except Exception as e:
+                for future, _ in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (future, _), row in zip(batch, probabilities):
+                future.set_result(row)
+    
+    def _build_lookups(self):
+        """Turn the fitted categories into value -> code dicts and a probability column -> action list"""
+        self._enc = {
+            name: {value: code for code, value in enumerate(categories)}
+            for name, categories in self.categories.items()
         }
+        # Probability columns follow model.classes_, which skips actions missing from the training split
+        self._inv_action = [self.categories['action'][code] for code in self.model.classes_]
+    
+    def _build_fil_model(self):
+        """Convert the trained forest to cuML FIL for fast small-batch inference"""
+        if ForestInference is None:
+            return None
         
-        return explanations.get(action, f"Based on your {context['trip_type']} driving patterns")
+        try:
+            fil_model = ForestInference.load_from_sklearn(self.model, output_class=True)
+            # Tune the tree layout and chunk size for the micro-batches _batch_worker sends
+            fil_model.optimize(batch_size=MAX_BATCH)
+        except Exception as e:
+            print(f"FIL conversion failed, using sklearn for predictions: {e}")
+            return None
+        
+        print("Using cuML Forest Inference for predictions")
+        return fil_model
+    
+    def _explain_recommendation(self, driver_id, action, context):
+        """Generate human-readable explanation for recommendation"""
+        template = _EXPL.get(action)
+        if template is None:
+            return f"Based on your {context['trip_type']} driving patterns"
+        return template.format(**context)
     
     def save_model(self, filepath):
         """Save the trained model and encoders"""
+        # Driver patterns go to a columnar Feather file next to the model
+        patterns_file = os.path.splitext(os.path.basename(filepath))[0] + '_patterns.feather'
+        feather.write_feather(self.driver_patterns_df, os.path.join(os.path.dirname(filepath), patterns_file))
+        
         model_data = {
             'model': self.model,
-            'label_encoders': self.label_encoders,
-            'driver_patterns': dict(self.driver_patterns),
+            'categories': self.categories,
+            'driver_patterns_file': patterns_file,
             'driver_sequences': dict(self.driver_sequences),
+            'feature_dtype': np.dtype(self.feature_dtype).str,
             'is_trained': self.is_trained
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        joblib.dump(model_data, filepath, compress=('lz4', 3), protocol=5)
         
         print(f"Model saved to {filepath}")
     
     def load_model(self, filepath):
         """Load a trained model"""
-        with open(filepath, 'rb') as f:
-            model_data = pickle.load(f)
+        model_data = joblib.load(filepath)
         
         self.model = model_data['model']
-        self.label_encoders = model_data['label_encoders']
-        self.driver_patterns = defaultdict(list, model_data['driver_patterns'])
+        self.categories = model_data['categories']
+        
+        self.driver_patterns_df = feather.read_feather(
+            os.path.join(os.path.dirname(filepath), model_data['driver_patterns_file']))
+        self._driver_rows = self.driver_patterns_df.groupby('driver_id').indices
         self.driver_sequences = defaultdict(list, model_data['driver_sequences'])
+        self.feature_dtype = np.dtype(model_data['feature_dtype'])
         self.is_trained = model_data['is_trained']
+        self.fil_model = self._build_fil_model()
+        self._build_lookups()
+        self._predict_cached.cache_clear()
         
         print(f"Model loaded from {filepath}")
 